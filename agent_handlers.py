@@ -2,11 +2,16 @@
 Handlers for agentic interactions with the Telegram bot using Ollama LLM.
 """
 
+import asyncio
 import logging
-from telegram import Update
+import os
+from uuid import uuid4
+from telegram import ChatMember, InlineQuery, InlineQueryResultArticle, InputTextMessageContent, Update
 from telegram.ext import ContextTypes
 from ollama_connector import OllamaConnector
-from typing import Dict, Optional
+from send_queue import MAX_MESSAGE_LENGTH, reply_text
+from model_router import routing_stats
+from typing import Dict, Optional, Tuple
 
 # Set up logging
 logging.basicConfig(
@@ -18,6 +23,23 @@ logger = logging.getLogger(__name__)
 # Dictionary to store user's conversation history
 conversations: Dict[int, list] = {}
 
+# In-flight generation per (chat, user), cancelled when superseded. Keying by
+# user too means that in a group one member cannot cancel another's answer.
+active_generations: Dict[Tuple[int, int], asyncio.Task] = {}
+
+# Newest message claimed per (chat, user). Handlers claim before their first
+# await, so a slower handler for an older message cannot cancel a newer one.
+latest_messages: Dict[Tuple[int, int], int] = {}
+
+# Pending inline query per user, replaced on every keystroke
+pending_inline_queries: Dict[int, asyncio.Task] = {}
+
+# Seconds to wait for the user to stop typing before answering an inline query
+INLINE_DEBOUNCE = float(os.getenv('INLINE_DEBOUNCE', 0.8))
+
+# Telegram drops inline query answers that arrive too late
+INLINE_TIMEOUT = float(os.getenv('INLINE_TIMEOUT', 10))
+
 # Default system prompt for the agent
 DEFAULT_SYSTEM_PROMPT = """You are a helpful AI assistant on Telegram.
 You provide informative, concise, and accurate responses.
@@ -38,6 +60,109 @@ def setup_agent(model_name: str = "llama3.2") -> None:
     ollama_connector = OllamaConnector(model_name)
     logger.info(f"Agent set up with model: {model_name}")
 
+def cancel_generation(chat_id: int, user_id: int) -> bool:
+    """
+    Abort the generation running for a user in a chat, if any.
+    
+    Args:
+        chat_id (int): The chat the generation is for
+        user_id (int): The user who asked for it
+        
+    Returns:
+        bool: True if a running generation was cancelled
+    """
+    task = active_generations.pop((chat_id, user_id), None)
+    if task is None or task.done():
+        return False
+    task.cancel()
+    logger.info(f"Cancelled in-flight generation for user {user_id} in chat {chat_id}")
+    return True
+
+def cancel_chat_generations(chat_id: int) -> None:
+    """
+    Abort every generation running in a chat.
+    
+    Args:
+        chat_id (int): The chat whose generations should be cancelled
+    """
+    for key in [key for key in active_generations if key[0] == chat_id]:
+        cancel_generation(*key)
+
+def claim_generation(chat_id: int, user_id: int, message_id: int) -> bool:
+    """
+    Mark a message as the newest one a user wants answered in a chat.
+    
+    Must be called before the handler's first await. Any generation for an
+    older message of the same user is cancelled.
+    
+    Args:
+        chat_id (int): The chat the message was sent in
+        user_id (int): The user who sent it
+        message_id (int): The message to answer
+        
+    Returns:
+        bool: False if a newer message has already been claimed
+    """
+    key = (chat_id, user_id)
+    if message_id < latest_messages.get(key, message_id):
+        return False
+    latest_messages[key] = message_id
+    cancel_generation(chat_id, user_id)
+    return True
+
+def is_superseded(chat_id: int, user_id: int, message_id: int) -> bool:
+    """
+    Return True if the user has sent a newer message since message_id was claimed.
+    """
+    return latest_messages.get((chat_id, user_id)) != message_id
+
+async def generate_for_chat(
+    chat_id: int,
+    user_id: int,
+    message_id: int,
+    prompt: str,
+    command: str
+) -> Optional[str]:
+    """
+    Generate a response for a claimed message, unless the user has sent a
+    newer message in the chat since.
+    
+    Args:
+        chat_id (int): The chat the response is for
+        user_id (int): The user who asked
+        message_id (int): The message being answered, claimed with claim_generation
+        prompt (str): The user prompt
+        command (str): The bot command the prompt came from
+        
+    Returns:
+        Optional[str]: The response, or None if the message was superseded
+    """
+    key = (chat_id, user_id)
+    if is_superseded(chat_id, user_id, message_id):
+        return None
+    cancel_generation(chat_id, user_id)
+    task = asyncio.create_task(ollama_connector.generate_response(
+        prompt=prompt,
+        system_prompt=DEFAULT_SYSTEM_PROMPT,
+        command=command
+    ))
+    active_generations[key] = task
+    try:
+        response = await task
+    except asyncio.CancelledError:
+        # Re-raise only if this handler itself is being cancelled
+        if asyncio.current_task().cancelling():
+            raise
+        return None
+    finally:
+        if active_generations.get(key) is task:
+            del active_generations[key]
+    
+    if is_superseded(chat_id, user_id, message_id):
+        return None
+    del latest_messages[key]
+    return response
+
 async def ask_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handle the /ask command to interact with the LLM.
@@ -50,19 +175,24 @@ async def ask_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     
     # Check if a prompt was provided
     if not context.args:
-        await update.message.reply_text("Please provide a question after /ask. For example: /ask What is Python?")
+        await reply_text(update, "Please provide a question after /ask. For example: /ask What is Python?")
         return
     
     # Join all arguments to form the prompt
     prompt = " ".join(context.args)
     
+    # Supersede older messages before awaiting anything
+    message_id = update.message.message_id
+    if not claim_generation(update.effective_chat.id, user_id, message_id):
+        return
+    
     # Send typing action to indicate processing
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
     
     # First check if Ollama is running
     ollama_running = await ollama_connector.check_ollama_running()
     if not ollama_running:
-        await update.message.reply_text(
+        await reply_text(update, 
             "❌ Ollama service is not running or not accessible.\n\n"
             "Please start Ollama with the following command:\n"
             "```\nollama serve\n```\n"
@@ -72,18 +202,18 @@ async def ask_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     
     try:
         # Get response from Ollama
-        await update.message.reply_text("🤔 Thinking...")
-        response = await ollama_connector.generate_response(
-            prompt=prompt,
-            system_prompt=DEFAULT_SYSTEM_PROMPT
-        )
+        await reply_text(update, "🤔 Thinking...", wait=False)
+        response = await generate_for_chat(update.effective_chat.id, user_id, message_id, prompt, "ask")
+        if response is None:
+            # Superseded by a newer message or /endchat
+            return
         
         # Send the response
-        await update.message.reply_text(response)
+        await reply_text(update, response)
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Error in ask_command: {error_msg}")
-        await update.message.reply_text(
+        await reply_text(update, 
             f"Sorry, I encountered an error: {error_msg}\n\n"
             "Please make sure Ollama is running and the model is properly installed."
         )
@@ -101,7 +231,7 @@ async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Check if Ollama is running before starting a chat
     ollama_running = await ollama_connector.check_ollama_running()
     if not ollama_running:
-        await update.message.reply_text(
+        await reply_text(update, 
             "❌ Ollama service is not running or not accessible.\n\n"
             "Please start Ollama with the following command:\n"
             "```\nollama serve\n```\n"
@@ -113,7 +243,7 @@ async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if user_id not in conversations:
         conversations[user_id] = []
     
-    await update.message.reply_text(
+    await reply_text(update, 
         "Chat session started! You can now have a conversation with the AI. "
         "Your messages will be sent to the AI until you type /endchat to end the session."
     )
@@ -131,6 +261,9 @@ async def endchat_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """
     user_id = update.effective_user.id
     
+    # Stop any reply that is still being generated for this user
+    claim_generation(update.effective_chat.id, user_id, update.message.message_id)
+    
     # Check if user is in chat mode
     if context.user_data.get("in_chat_mode", False):
         # Clear conversation history
@@ -140,9 +273,9 @@ async def endchat_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # Set chat mode to False
         context.user_data["in_chat_mode"] = False
         
-        await update.message.reply_text("Chat session ended. You can start a new one with /chat.")
+        await reply_text(update, "Chat session ended. You can start a new one with /chat.")
     else:
-        await update.message.reply_text("You're not in a chat session. Use /chat to start one.")
+        await reply_text(update, "You're not in a chat session. Use /chat to start one.")
 
 async def models_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -158,7 +291,7 @@ async def models_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # First check if Ollama is running
         ollama_running = await ollama_connector.check_ollama_running()
         if not ollama_running:
-            await update.message.reply_text(
+            await reply_text(update, 
                 "❌ Ollama service is not running or not accessible.\n\n"
                 "Please start Ollama with the following command:\n"
                 "```\nollama serve\n```\n"
@@ -167,15 +300,15 @@ async def models_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
             
         # If Ollama is running, proceed to fetch models
-        await update.message.reply_text("Fetching available models from Ollama...")
+        await reply_text(update, "Fetching available models from Ollama...", wait=False)
         models = await ollama_connector.get_available_models()
         
         if models:
             models_text = "Available models:\n" + "\n".join([f"- {model}" for model in models])
-            await update.message.reply_text(models_text)
+            await reply_text(update, models_text)
         else:
             # Provide more detailed error message
-            await update.message.reply_text(
+            await reply_text(update, 
                 "No models found. Please check:\n"
                 "1. You've pulled at least one model using:\n"
                 "   `ollama pull llama3.2`\n"
@@ -185,7 +318,7 @@ async def models_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Error in models_command: {error_msg}")
-        await update.message.reply_text(
+        await reply_text(update, 
             f"Error retrieving models: {error_msg}\n\n"
             "Please ensure Ollama is properly installed and running."
         )
@@ -201,7 +334,7 @@ async def setmodel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     global ollama_connector
     
     if not context.args:
-        await update.message.reply_text(
+        await reply_text(update, 
             "Please specify a model name. Example: /setmodel llama3.2\n"
             "Use /models to see available models."
         )
@@ -212,7 +345,7 @@ async def setmodel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     # Check if Ollama is running
     ollama_running = await ollama_connector.check_ollama_running()
     if not ollama_running:
-        await update.message.reply_text(
+        await reply_text(update, 
             "❌ Ollama service is not running or not accessible.\n\n"
             "Please start Ollama with the following command:\n"
             "```\nollama serve\n```\n"
@@ -224,7 +357,7 @@ async def setmodel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         # Check if the model exists
         available_models = await ollama_connector.get_available_models()
         if available_models and model_name not in available_models:
-            await update.message.reply_text(
+            await reply_text(update, 
                 f"⚠️ Model '{model_name}' is not available.\n\n"
                 f"Available models: {', '.join(available_models)}\n\n"
                 f"You can pull a new model with:\n"
@@ -235,15 +368,44 @@ async def setmodel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         # Create a new connector with the specified model
         ollama_connector = OllamaConnector(model_name)
         
-        await update.message.reply_text(f"Model changed to {model_name}")
+        await reply_text(update, f"Model changed to {model_name}")
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Error in setmodel_command: {error_msg}")
-        await update.message.reply_text(
+        await reply_text(update, 
             f"Error changing model: {error_msg}\n\n"
             "Please make sure Ollama is running and the model is properly installed."
         )
 
+async def routing_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handle the /routing command to show cascade routing statistics.
+    
+    Args:
+        update (Update): The update object containing information about the message
+        context (ContextTypes.DEFAULT_TYPE): The context for the callback
+    """
+    if not ollama_connector.router:
+        await reply_text(
+            update,
+            "Cascade routing is disabled. Set SMALL_MODEL in your .env file to enable it."
+        )
+        return
+    
+    stats = routing_stats.summary()
+    avg_latency = stats["avg_latency"]
+    await reply_text(
+        update,
+        f"Small model: {ollama_connector.router.small_model}\n"
+        f"Large model: {ollama_connector.model_name}\n\n"
+        f"Routed to small model: {stats['routed_small']}\n"
+        f"Routed to large model: {stats['routed_large']}\n"
+        f"Escalated to large model: {stats['escalated']}\n"
+        f"Average latency (small/large): "
+        f"{avg_latency.get('small', 0):.2f}s / {avg_latency.get('large', 0):.2f}s\n"
+        f"Estimated latency saved: {stats['latency_saved']:.1f}s"
+    )
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handle regular messages when user is in chat mode.
@@ -260,6 +422,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     # Check if user is in chat mode
     if context.user_data.get("in_chat_mode", False):
+        # Supersede older messages before awaiting anything
+        message_id = update.message.message_id
+        if not claim_generation(update.effective_chat.id, user_id, message_id):
+            return
+        
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
         # Add user message to conversation history
@@ -271,14 +438,94 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # as we'll just directly pass the prompt to generate_response
         
         try:
-            # Generate response
-            response = await ollama_connector.generate_response(
-                prompt=user_message,
-                system_prompt=DEFAULT_SYSTEM_PROMPT
-            )
+            # Generate response unless a newer message has arrived meanwhile
+            response = await generate_for_chat(update.effective_chat.id, user_id, message_id, user_message, "chat")
+            if response is None:
+                # Superseded by a newer message or /endchat
+                return
             
             # Send the response
-            await update.message.reply_text(response)
+            await reply_text(update, response)
         except Exception as e:
             logger.error(f"Error in handle_message: {str(e)}")
-            await update.message.reply_text(f"Sorry, I encountered an error: {str(e)}") 
\ No newline at end of file
+            await reply_text(update, f"Sorry, I encountered an error: {str(e)}") 
+
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Cancel in-flight generations when the bot is removed or blocked in a chat.
+    
+    Args:
+        update (Update): The update object containing the bot's new membership
+        context (ContextTypes.DEFAULT_TYPE): The context for the callback
+    """
+    status = update.my_chat_member.new_chat_member.status
+    if status in (ChatMember.LEFT, ChatMember.BANNED):
+        cancel_chat_generations(update.effective_chat.id)
+
+async def _answer_inline_query(query: InlineQuery) -> None:
+    """
+    Wait for the user to stop typing, then answer the inline query.
+    
+    Nothing is answered if the generation fails or takes longer than
+    INLINE_TIMEOUT, so error messages are never offered as results.
+    
+    Args:
+        query (InlineQuery): The inline query to answer
+    """
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    try:
+        generated = await ollama_connector.generate(
+            prompt=query.query,
+            system_prompt=DEFAULT_SYSTEM_PROMPT,
+            command="inline",
+            timeout=INLINE_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.info(f"Inline query from user {query.from_user.id} timed out, not answering")
+        return
+    except Exception as e:
+        logger.error(f"Error generating inline answer: {str(e)}")
+        return
+    
+    response = generated["message"]["content"].strip()
+    if not response:
+        return
+    result = InlineQueryResultArticle(
+        id=str(uuid4()),
+        title=query.query[:64],
+        description=response[:100],
+        input_message_content=InputTextMessageContent(response[:MAX_MESSAGE_LENGTH])
+    )
+    await query.answer([result], cache_time=0, is_personal=True)
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handle inline queries, generating an answer only for the latest keystroke.
+    
+    Args:
+        update (Update): The update object containing the inline query
+        context (ContextTypes.DEFAULT_TYPE): The context for the callback
+    """
+    query = update.inline_query
+    user_id = query.from_user.id
+    
+    # A newer keystroke supersedes the previous query
+    previous = pending_inline_queries.pop(user_id, None)
+    if previous is not None and not previous.done():
+        previous.cancel()
+    
+    if not query.query.strip():
+        return
+    
+    task = asyncio.create_task(_answer_inline_query(query))
+    pending_inline_queries[user_id] = task
+    try:
+        await task
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise
+    except Exception as e:
+        logger.error(f"Error in inline_query_handler: {str(e)}")
+    finally:
+        if pending_inline_queries.get(user_id) is task:
+            del pending_inline_queries[user_id]
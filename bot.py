@@ -3,12 +3,16 @@ import os
 import asyncio
 from flask import Flask, request
 from telegram import Update, Bot
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, Updater
+from telegram.ext import (
+    ApplicationBuilder, ChatMemberHandler, CommandHandler, InlineQueryHandler, MessageHandler, filters, Updater
+)
 from handlers import start, help_command, change_language, hello
 from agent_handlers import (
     setup_agent, ask_command, chat_command, endchat_command, 
-    models_command, setmodel_command, handle_message
+    models_command, setmodel_command, routing_command, handle_message,
+    chat_member_update, inline_query_handler
 )
+from send_queue import setup_send_queue
 from dotenv import load_dotenv, dotenv_values
 
 load_dotenv()
@@ -33,7 +37,12 @@ app = Flask(__name__)
 bot = Bot(token=BOT_TOKEN)
 update_queue = asyncio.Queue()
 updater = Updater(bot=bot, update_queue=update_queue)
-application = ApplicationBuilder().token(BOT_TOKEN).build()
+# Updates are processed concurrently so that a new message can cancel the
+# generation still running for the previous one
+application = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(True).build()
+
+# Route all replies through the rate-limited send queue
+send_queue = setup_send_queue(application.bot)
 
 # Set up the Ollama agent
 setup_agent(model_name=DEFAULT_MODEL)
@@ -50,6 +59,13 @@ application.add_handler(CommandHandler("chat", chat_command))
 application.add_handler(CommandHandler("endchat", endchat_command))
 application.add_handler(CommandHandler("models", models_command))
 application.add_handler(CommandHandler("setmodel", setmodel_command))
+application.add_handler(CommandHandler("routing", routing_command))
+
+# Cancel generations for chats the bot was removed from
+application.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.MY_CHAT_MEMBER))
+
+# Answer inline queries (inline mode must be enabled with BotFather)
+application.add_handler(InlineQueryHandler(inline_query_handler))
 
 # Add message handler for chat mode (must be added last)
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -81,7 +97,7 @@ async def main():
             await application.start()
             await application.updater.start_polling()
             logger.info(f"Bot started with Ollama integration using model: {DEFAULT_MODEL}")
-            logger.info(f"Available commands: /start, /help, /lang, /ask, /chat, /endchat, /models, /setmodel")
+            logger.info(f"Available commands: /start, /help, /lang, /ask, /chat, /endchat, /models, /setmodel, /routing")
             
             # Create a proper event to wait on
             stop_signal = asyncio.Event()
@@ -90,6 +106,12 @@ async def main():
         logger.error(f"Error in main function: {str(e)}")
         raise
     finally:
+        # Deliver replies that are still queued
+        try:
+            await send_queue.close()
+        except Exception as e:
+            logger.error(f"Error flushing send queue: {str(e)}")
+        
         # Ensure proper cleanup
         if 'application' in locals() and application:
             try:
@@ -1,6 +1,7 @@
 from telegram import Update
 from telegram.ext import CommandHandler, CallbackContext
 import json
+from send_queue import reply_text
 
 # load environment variables
 from dotenv import load_dotenv, dotenv_values
@@ -45,7 +46,7 @@ async def start(update: Update, context: CallbackContext) -> None:
         None
     """
     user_lang = context.user_data.get('lang', DEFAULT_LANGUAGE)
-    await update.message.reply_text(translate('Hello! Welcome to the bot.', user_lang))
+    await reply_text(update, translate('Hello! Welcome to the bot.', user_lang))
 
 async def hello(update: Update, context: CallbackContext) -> None:
     """
@@ -59,7 +60,7 @@ async def hello(update: Update, context: CallbackContext) -> None:
         None
     """
     user_lang = context.user_data.get('lang', DEFAULT_LANGUAGE)
-    await update.message.reply_text(translate(f'Hello', user_lang) + f' {update.effective_user.first_name}!')
+    await reply_text(update, translate(f'Hello', user_lang) + f' {update.effective_user.first_name}!')
 
 async def help_command(update: Update, context: CallbackContext) -> None:
     """
@@ -85,11 +86,12 @@ This bot now has AI capabilities powered by a local LLM through Ollama:
 /endchat - End your conversation with the AI
 /models - See available AI models
 /setmodel [model] - Change the AI model being used
+/routing - See how requests are split between the small and large model
 
 Enjoy chatting with the AI assistant!
 """
     
-    await update.message.reply_text(help_text + ai_help)
+    await reply_text(update, help_text + ai_help)
 
 async def change_language(update: Update, context: CallbackContext) -> None:
     """
@@ -105,10 +107,10 @@ async def change_language(update: Update, context: CallbackContext) -> None:
     lang = context.args[0] if context.args else DEFAULT_LANGUAGE
     if lang in translations:
         context.user_data['lang'] = lang
-        await update.message.reply_text(translate('Language changed successfully.', lang))
+        await reply_text(update, translate('Language changed successfully.', lang))
     else:
-        await update.message.reply_text(translate('Language not supported.', DEFAULT_LANGUAGE))
+        await reply_text(update, translate('Language not supported.', DEFAULT_LANGUAGE))
 
 # Add new command handler
 # async def new_handler(update: Update, context: CallbackContext) -> None:
-#     await update.message.reply_text('New command handler!')
\ No newline at end of file
+#     await reply_text(update, 'New command handler!')
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+Cascade routing of LLM requests between a small fast model and a large model.
+
+Prompts are classified with cheap heuristics before generation. Easy prompts
+are answered by the small model; hard prompts, and small-model answers that
+look unreliable, go to the large model. Routing decisions and the estimated
+latency saved are kept in a shared RoutingStats object.
+"""
+
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Routing is enabled when a small model is configured
+SMALL_MODEL = os.environ.get('SMALL_MODEL')
+
+# Prompts longer than this many characters go straight to the large model
+ROUTER_MAX_SMALL_CHARS = int(os.environ.get('ROUTER_MAX_SMALL_CHARS', 280))
+
+# Commands whose prompts always go to the large model (comma separated)
+ROUTER_LARGE_COMMANDS = {
+    command.strip() for command in os.environ.get('ROUTER_LARGE_COMMANDS', '').split(',') if command.strip()
+}
+
+# Words that usually signal reasoning, coding or long-form writing
+HARD_KEYWORDS = re.compile(
+    r"\b(why|explain|prove|proof|derive|analy[sz]e|compare|difference between|step by step|"
+    r"calculate|solve|equation|algorithm|code|function|debug|error|implement|refactor|"
+    r"write (an?|the) (essay|story|article|program|script|report)|summari[sz]e|translate|plan)\b",
+    re.IGNORECASE,
+)
+
+# Phrases that suggest the small model was not confident in its answer
+LOW_CONFIDENCE = re.compile(
+    r"(i'?m not sure|i am not sure|i don'?t know|i do not know|i'?m unable to|i cannot answer|"
+    r"i can'?t answer|not certain|i don'?t have (enough )?information)",
+    re.IGNORECASE,
+)
+
+# Weight of the newest sample in the moving latency averages
+LATENCY_SMOOTHING = 0.2
+
+
+class RoutingStats:
+    """
+    Thread-safe counters for routing decisions and latency.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routed_small = 0
+        self.routed_large = 0
+        self.escalated = 0
+        self.latency_saved = 0.0
+        self.avg_latency: Dict[str, float] = {}
+
+    def observe_latency(self, tier: str, latency: float) -> None:
+        """
+        Update the moving average latency of a tier ("small" or "large").
+        """
+        with self._lock:
+            previous = self.avg_latency.get(tier)
+            if previous is None:
+                self.avg_latency[tier] = latency
+            else:
+                self.avg_latency[tier] = previous + LATENCY_SMOOTHING * (latency - previous)
+
+    def record(self, tier: str, escalated: bool, small_latency: Optional[float]) -> None:
+        """
+        Record the outcome of one routed request.
+
+        Args:
+            tier (str): Tier chosen by the classifier ("small" or "large")
+            escalated (bool): Whether a small-model answer was rejected
+            small_latency (Optional[float]): Seconds spent on the small model
+        """
+        with self._lock:
+            if tier == "large":
+                self.routed_large += 1
+                return
+            self.routed_small += 1
+            if escalated:
+                # The small attempt was pure overhead
+                self.escalated += 1
+                self.latency_saved -= small_latency or 0.0
+            elif "large" in self.avg_latency and small_latency is not None:
+                self.latency_saved += self.avg_latency["large"] - small_latency
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the counters.
+        """
+        with self._lock:
+            return {
+                "routed_small": self.routed_small,
+                "routed_large": self.routed_large,
+                "escalated": self.escalated,
+                "latency_saved": self.latency_saved,
+                "avg_latency": dict(self.avg_latency),
+            }
+
+
+# Shared across connectors so that /setmodel does not reset the numbers
+routing_stats = RoutingStats()
+
+
+class ModelRouter:
+    """
+    Chooses between a small and a large model for each prompt.
+    """
+
+    def __init__(
+        self,
+        small_model: str,
+        max_small_chars: int = ROUTER_MAX_SMALL_CHARS,
+        large_commands: Optional[set] = None,
+    ):
+        """
+        Initialize the router.
+
+        Args:
+            small_model (str): Name of the small fast model
+            max_small_chars (int): Longest prompt the small model may answer
+            large_commands (Optional[set]): Commands that always use the large model
+        """
+        self.small_model = small_model
+        self.max_small_chars = max_small_chars
+        self.large_commands = ROUTER_LARGE_COMMANDS if large_commands is None else large_commands
+        self.stats = routing_stats
+
+    def classify(self, prompt: str, command: Optional[str] = None) -> tuple:
+        """
+        Decide which tier should answer a prompt.
+
+        Args:
+            prompt (str): The user prompt
+            command (Optional[str]): The bot command the prompt came from
+
+        Returns:
+            tuple: The tier ("small" or "large") and the reason for the choice
+        """
+        if command in self.large_commands:
+            return "large", f"command /{command}"
+        if len(prompt) > self.max_small_chars:
+            return "large", "long prompt"
+        if "```" in prompt or prompt.count("\n") > 3:
+            return "large", "structured prompt"
+        match = HARD_KEYWORDS.search(prompt)
+        if match:
+            return "large", f"keyword '{match.group(0).lower()}'"
+        if prompt.count("?") > 1:
+            return "large", "multiple questions"
+        return "small", "simple prompt"
+
+    def should_escalate(self, response: Any) -> Optional[str]:
+        """
+        Check whether a small-model answer should be redone by the large model.
+
+        Args:
+            response (Any): The Ollama chat response from the small model
+
+        Returns:
+            Optional[str]: The reason to escalate, or None to keep the answer
+        """
+        if not response or "message" not in response:
+            return "no answer"
+        content = (response["message"]["content"] or "").strip()
+        if not content:
+            return "empty answer"
+        if response.get("done_reason") == "length":
+            return "truncated answer"
+        if LOW_CONFIDENCE.search(content):
+            return "low confidence"
+        return None
+
+
+def get_model_router() -> Optional[ModelRouter]:
+    """
+    Return a router when SMALL_MODEL is set, otherwise None.
+
+    Returns:
+        Optional[ModelRouter]: A router for the configured small model
+    """
+    if not SMALL_MODEL:
+        return None
+    return ModelRouter(SMALL_MODEL)
@@ -10,6 +10,8 @@ import os
 from typing import Dict, Any, Optional, List
 import requests
 import concurrent.futures
+from traffic_recorder import get_traffic_recorder
+from model_router import get_model_router
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +19,13 @@ logger = logging.getLogger(__name__)
 # Limit max workers to avoid overloading the system
 thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
 
+# Generations are streamed on the event loop instead of the thread pool so
+# they can be cancelled; this keeps the same limit on concurrent requests
+generation_slots = asyncio.Semaphore(4)
+
+# Seconds before a generation is aborted
+GENERATION_TIMEOUT = float(os.environ.get('GENERATION_TIMEOUT', 120))
+
 # Get Ollama host from environment or use default
 OLLAMA_HOST = os.environ.get('OLLAMA_HOST', 'localhost')
 OLLAMA_PORT = os.environ.get('OLLAMA_PORT', '11434')
@@ -26,6 +35,17 @@ OLLAMA_BASE_URL = f"http://{OLLAMA_HOST}:{OLLAMA_PORT}"
 ollama.host = OLLAMA_BASE_URL
 logger.info(f"Configured Ollama client to use: {OLLAMA_BASE_URL}")
 
+# Fields of the final streamed chunk kept on the assembled response
+RESPONSE_FIELDS = (
+    "done_reason",
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+
 class OllamaConnector:
     """
     Connector class for the Ollama LLM service.
@@ -39,7 +59,12 @@ class OllamaConnector:
             model_name (str): Name of the model to use (default: "llama3.2")
         """
         self.model_name = model_name
+        self.client = ollama.AsyncClient(host=OLLAMA_BASE_URL)
+        self.recorder = get_traffic_recorder()
+        self.router = get_model_router()
         logger.info(f"Initialized Ollama connector with model: {model_name}")
+        if self.router:
+            logger.info(f"Cascade routing enabled with small model: {self.router.small_model}")
         logger.info(f"Using Ollama at: {OLLAMA_BASE_URL}")
         
         # Try to check connection to Ollama service
@@ -66,35 +91,182 @@ class OllamaConnector:
             lambda: func(*args, **kwargs)
         )
         
-    async def generate_response(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+    async def _chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        options: Optional[Dict[str, Any]] = None,
+        route: Optional[str] = None,
+        deadline: Optional[float] = None
+    ):
         """
-        Generate a response from the LLM based on the given prompt.
+        Stream a chat request from Ollama and record it when recording is enabled.
+        
+        The response is streamed so that cancelling the calling task closes the
+        connection, which makes Ollama stop generating. Only requests that were
+        actually sent are recorded.
+        
+        Args:
+            deadline (Optional[float]): Event loop time at which the request is
+                aborted with asyncio.TimeoutError, including time spent waiting
+                for a free generation slot
+        
+        Returns:
+            tuple: The assembled response and the request latency in seconds
+        """
+        content = []
+        final = {}
+        sent = False
+        try:
+            async with asyncio.timeout_at(deadline):
+                async with generation_slots:
+                    started = time.time()
+                    start = time.perf_counter()
+                    sent = True
+                    stream = await self.client.chat(
+                        model=model,
+                        messages=messages,
+                        options=options,
+                        stream=True
+                    )
+                    try:
+                        async for part in stream:
+                            content.append(part["message"]["content"] or "")
+                            if part.get("done"):
+                                final = part
+                    finally:
+                        await stream.aclose()
+        except BaseException as e:
+            if sent and self.recorder:
+                if isinstance(e, asyncio.TimeoutError):
+                    error = "timeout"
+                elif isinstance(e, asyncio.CancelledError):
+                    error = "cancelled"
+                else:
+                    error = str(e)
+                self.recorder.record(model, messages, options, started,
+                                     time.perf_counter() - start, error=error, route=route)
+            raise
+        latency = time.perf_counter() - start
+        
+        response = {"message": {"role": "assistant", "content": "".join(content)}}
+        for field in RESPONSE_FIELDS:
+            value = final.get(field) if final else None
+            if value is not None:
+                response[field] = value
+        if self.recorder:
+            self.recorder.record(model, messages, options, started,
+                                 latency, response=response, route=route)
+        return response, latency
+        
+    async def _routed_chat(
+        self,
+        prompt: str,
+        messages: List[Dict[str, str]],
+        options: Optional[Dict[str, Any]],
+        command: Optional[str],
+        deadline: Optional[float] = None
+    ):
+        """
+        Answer with the small model when the router allows it, escalating to
+        the large model (self.model_name) when the answer looks unreliable.
+        """
+        router = self.router
+        tier, reason = router.classify(prompt, command)
+        if tier == "large" or router.small_model == self.model_name:
+            logger.info(f"Routing to {self.model_name}: {reason}")
+            response, latency = await self._chat(self.model_name, messages, options, "large", deadline)
+            router.stats.observe_latency("large", latency)
+            router.stats.record("large", False, None)
+            return response
+        
+        logger.info(f"Routing to {router.small_model}: {reason}")
+        small_start = time.perf_counter()
+        try:
+            response, latency = await self._chat(router.small_model, messages, options, "small", deadline)
+            router.stats.observe_latency("small", latency)
+            escalation = router.should_escalate(response)
+        except asyncio.TimeoutError:
+            # No time is left for the large model either
+            raise
+        except Exception as e:
+            logger.warning(f"Small model {router.small_model} failed: {str(e)}")
+            escalation = "small model error"
+        
+        if escalation is None:
+            router.stats.record("small", False, latency)
+            return response
+        
+        small_latency = time.perf_counter() - small_start
+        logger.info(f"Escalating to {self.model_name}: {escalation}")
+        response, latency = await self._chat(self.model_name, messages, options, "escalated", deadline)
+        router.stats.observe_latency("large", latency)
+        router.stats.record("small", True, small_latency)
+        return response
+        
+    async def generate(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        command: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate a response from the LLM, raising on failure.
+        
+        When cascade routing is enabled, easy prompts are answered by the
+        small model and everything else by self.model_name.
+        
+        Cancelling the calling task aborts the generation on the Ollama side.
         
         Args:
             prompt (str): The user prompt to send to the LLM
             system_prompt (Optional[str]): Optional system prompt to guide model behavior
+            options (Optional[Dict[str, Any]]): Optional Ollama generation options
+            command (Optional[str]): The bot command the prompt came from, used for routing
+            timeout (Optional[float]): Seconds before the generation is aborted
+                (default: GENERATION_TIMEOUT)
+            
+        Returns:
+            Dict[str, Any]: The Ollama response
+            
+        Raises:
+            asyncio.TimeoutError: If the generation took longer than timeout
+        """
+        # Create message format for ollama.chat() - as per 0.4.x API
+        messages = [{"role": "user", "content": prompt}]
+        
+        # Add system prompt if provided
+        if system_prompt:
+            messages.insert(0, {"role": "system", "content": system_prompt})
+        
+        # The deadline bounds the whole generation, including any escalation
+        deadline = asyncio.get_running_loop().time() + (timeout or GENERATION_TIMEOUT)
+        if self.router:
+            return await self._routed_chat(prompt, messages, options, command, deadline)
+        response, _ = await self._chat(self.model_name, messages, options, deadline=deadline)
+        return response
+        
+    async def generate_response(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        command: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> str:
+        """
+        Generate a response from the LLM based on the given prompt.
+        
+        Errors and timeouts are turned into a message for the user; see
+        generate() for the arguments.
             
         Returns:
             str: The generated response
         """
         try:
-            # Create message format for ollama.chat() - as per 0.4.x API
-            messages = [{"role": "user", "content": prompt}]
-            
-            # Add system prompt if provided
-            if system_prompt:
-                messages.insert(0, {"role": "system", "content": system_prompt})
-            
-            # Define the function to call Ollama    
-            def call_ollama():
-                return ollama.chat(
-                    model=self.model_name,
-                    messages=messages,
-                    stream=False
-                )
-                
-            # Use the executor to run the ollama.chat in a separate thread
-            response = await self._run_in_executor(call_ollama)
+            response = await self.generate(prompt, system_prompt, options, command, timeout)
             
             if response and "message" in response:
                 return response["message"]["content"]
@@ -102,6 +274,9 @@ class OllamaConnector:
                 logger.error(f"Unexpected response format: {response}")
                 return "Sorry, I had trouble generating a response. Please try again."
                 
+        except asyncio.TimeoutError:
+            logger.warning(f"Generation timed out after {timeout or GENERATION_TIMEOUT}s")
+            return "Sorry, generating a response took too long. Please try a shorter question."
         except Exception as e:
             logger.error(f"Error generating response from Ollama: {str(e)}")
             return f"Error: {str(e)}"
@@ -0,0 +1,235 @@
+"""
+Replay recorded LLM traffic against an Ollama endpoint and compare performance.
+
+Record traffic by starting the bot with OLLAMA_RECORD_PATH set, then run:
+
+    python replay.py traffic.jsonl --host http://localhost:11434 --speed 2
+
+Requests are re-sent with their original spacing divided by --speed (use
+--speed 0 to send them as fast as --concurrency allows). Latency and
+throughput of the replay are printed next to the recorded figures so that a
+model or quantization change can be judged against real traffic.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import ollama
+
+from traffic_recorder import read_traffic
+
+DEFAULT_HOST = "http://localhost:11434"
+
+
+def restore_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Rebuild sendable messages, filling redacted contents with placeholder text.
+
+    Args:
+        messages (List[Dict[str, Any]]): Messages as stored in the log
+
+    Returns:
+        List[Dict[str, Any]]: Messages in Ollama format
+    """
+    restored = []
+    for message in messages:
+        if "content" in message:
+            restored.append({"role": message["role"], "content": message["content"]})
+        else:
+            # Redacted entry: keep the original size so prompt cost is similar
+            filler = ("lorem ipsum " * (message.get("length", 0) // 12 + 1))[:message.get("length", 0)]
+            restored.append({"role": message["role"], "content": filler})
+    return restored
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Return the pct-th percentile of values using nearest-rank, or None if empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(entries: List[Dict[str, Any]], wall_time: float) -> Dict[str, Any]:
+    """
+    Compute latency and throughput figures for a set of log entries.
+
+    Args:
+        entries (List[Dict[str, Any]]): Recorded or replayed entries
+        wall_time (float): Seconds the traffic took from first send to last reply
+
+    Returns:
+        Dict[str, Any]: Summary statistics
+    """
+    ok = [entry for entry in entries if "error" not in entry]
+    latencies = [entry["latency"] for entry in ok]
+    tokens_per_second = [
+        entry["eval_count"] / (entry["eval_duration"] / 1e9)
+        for entry in ok
+        if entry.get("eval_count") and entry.get("eval_duration")
+    ]
+    output_tokens = sum(entry.get("eval_count", 0) for entry in ok)
+    return {
+        "requests": len(entries),
+        "errors": len(entries) - len(ok),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies) if latencies else None,
+        "gen_tokens_per_s_p50": percentile(tokens_per_second, 50),
+        "requests_per_s": len(ok) / wall_time if wall_time > 0 else None,
+        "output_tokens_per_s": output_tokens / wall_time if wall_time > 0 else None,
+    }
+
+
+def recorded_wall_time(entries: List[Dict[str, Any]]) -> float:
+    """
+    Return the span of the recorded traffic from first send to last reply.
+    """
+    if not entries:
+        return 0.0
+    return max(entry["ts"] + entry["latency"] for entry in entries) - entries[0]["ts"]
+
+
+async def replay(
+    entries: List[Dict[str, Any]],
+    host: str,
+    speed: float,
+    concurrency: int,
+    model: Optional[str] = None,
+    match_output: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Re-send recorded requests and measure each one.
+
+    Args:
+        entries (List[Dict[str, Any]]): Recorded entries, oldest first
+        host (str): Ollama endpoint to send the traffic to
+        speed (float): Time scale factor; 0 sends without pacing
+        concurrency (int): Maximum number of requests in flight
+        model (Optional[str]): Send every request to this model instead
+        match_output (bool): Cap each reply at the recorded output length
+
+    Returns:
+        List[Dict[str, Any]]: Replay results with the same fields as recorded entries
+    """
+    client = ollama.AsyncClient(host=host)
+    semaphore = asyncio.Semaphore(concurrency)
+    first_ts = entries[0]["ts"]
+    start = time.perf_counter()
+
+    async def send(entry: Dict[str, Any]) -> Dict[str, Any]:
+        if speed > 0:
+            delay = (entry["ts"] - first_ts) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        options = dict(entry.get("options") or {})
+        if match_output and entry.get("eval_count"):
+            options["num_predict"] = entry["eval_count"]
+        result = {
+            "ts": round(time.time(), 3),
+            "model": model or entry["model"],
+            "options": options,
+        }
+
+        async with semaphore:
+            sent = time.perf_counter()
+            try:
+                response = await client.chat(
+                    model=result["model"],
+                    messages=restore_messages(entry["messages"]),
+                    options=options,
+                    stream=False,
+                )
+                for field in ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration"):
+                    value = response.get(field)
+                    if value is not None:
+                        result[field] = value
+            except Exception as e:
+                result["error"] = str(e)
+            result["latency"] = round(time.perf_counter() - sent, 4)
+        return result
+
+    return await asyncio.gather(*(send(entry) for entry in entries))
+
+
+def format_value(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, int):
+        return str(value)
+    return f"{value:.3f}"
+
+
+def print_comparison(recorded: Dict[str, Any], replayed: Dict[str, Any]) -> None:
+    print(f"{'metric':<24}{'recorded':>14}{'replayed':>14}")
+    for key in recorded:
+        print(f"{key:<24}{format_value(recorded[key]):>14}{format_value(replayed[key]):>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded LLM traffic against an Ollama endpoint.")
+    parser.add_argument("log", help="Path of the traffic log written by the bot (rotated files are included)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Ollama endpoint to replay against (default: {DEFAULT_HOST})")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time scale factor, 0 for no pacing (default: 1)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum requests in flight (default: 4)")
+    parser.add_argument("--model", help="Send all requests to this model instead of the recorded one")
+    parser.add_argument("--limit", type=int, help="Only replay the first N requests")
+    parser.add_argument("--free-output", action="store_true", help="Do not cap replies at the recorded output length")
+    parser.add_argument("--output", help="Write replay results to this JSONL file")
+    parser.add_argument("--include-errors", action="store_true",
+                        help="Also replay requests that failed or were cancelled when recorded")
+    args = parser.parse_args()
+
+    entries = sorted(read_traffic(args.log), key=lambda entry: entry["ts"])
+    if not args.include_errors:
+        # Failed requests have no output length to reproduce
+        skipped = sum(1 for entry in entries if "error" in entry)
+        entries = [entry for entry in entries if "error" not in entry]
+        if skipped:
+            print(f"Skipping {skipped} recorded requests that failed (use --include-errors to replay them)")
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print(f"No recorded requests found in {args.log}")
+        return
+
+    print(f"Replaying {len(entries)} requests against {args.host} (speed={args.speed}, concurrency={args.concurrency})")
+    start = time.perf_counter()
+    results = asyncio.run(replay(
+        entries,
+        host=args.host,
+        speed=args.speed,
+        concurrency=args.concurrency,
+        model=args.model,
+        match_output=not args.free_output,
+    ))
+    wall_time = time.perf_counter() - start
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, separators=(",", ":")) + "\n")
+
+    # Compare only requests that succeeded on both sides
+    both_ok = [
+        index for index, (entry, result) in enumerate(zip(entries, results))
+        if "error" not in entry and "error" not in result
+    ]
+    recorded = summarize([entries[index] for index in both_ok], recorded_wall_time(entries))
+    replayed = summarize([results[index] for index in both_ok], wall_time)
+    for summary, side in ((recorded, entries), (replayed, results)):
+        summary["requests"] = len(side)
+        summary["errors"] = sum(1 for entry in side if "error" in entry)
+    print_comparison(recorded, replayed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,449 @@
+"""
+Rate-limited outbound message delivery for the Telegram bot.
+
+All replies go through a single SendQueue so that the bot respects Telegram's
+per-chat and global flood limits, honours RetryAfter responses and never tries
+to send a message longer than Telegram allows.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from telegram import Bot, Message, ReplyParameters, Update
+from telegram.constants import ChatType
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this many characters
+MAX_MESSAGE_LENGTH = 4096
+
+# Documented Telegram limits: ~30 messages/second overall, ~1 message/second
+# in a private chat and 20 messages/minute in a group
+GLOBAL_RATE = 30.0
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+CHAT_BURST = 3
+
+# How many times a single chunk is retried after a RetryAfter response
+MAX_RETRIES = 5
+
+FENCE = "```"
+
+
+class TokenBucket:
+    """
+    Asynchronous token bucket used to pace outgoing requests.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Initialize a bucket that starts full.
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (float): Maximum number of tokens the bucket can hold
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        # updated lies in the future while the bucket is paused
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+
+        Waiters are served in FIFO order by the internal lock.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def seconds_until_full(self) -> float:
+        """
+        Return how long until the bucket is full again and no longer blocked.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        blocked = max(0.0, self.blocked_until - now)
+        return blocked + (self.capacity - self.tokens) / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """
+        Block the bucket for the given number of seconds.
+
+        A single token is available as soon as the block ends, so a retry is
+        not delayed further by a refill.
+
+        Args:
+            seconds (float): How long no tokens should be handed out
+        """
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 1
+        self.updated = max(now, self.blocked_until)
+
+
+def _open_fence(text: str) -> Optional[str]:
+    """
+    Return the opening line of a code block left unclosed in text, if any.
+    """
+    opening = None
+    for line in text.split("\n"):
+        if line.startswith(FENCE):
+            opening = line if opening is None else None
+    return opening
+
+
+def _fence_marker(opening: str) -> str:
+    """
+    Return the fence and language tag that reopen a code block, e.g. "```python".
+    """
+    words = opening[len(FENCE):].split(maxsplit=1)
+    language = words[0] if words else ""
+    # A long "language" is really code written on the fence line
+    if len(language) > 32 or FENCE in language:
+        language = ""
+    return FENCE + language
+
+
+def _find_cut(text: str, window: int) -> Tuple[int, int]:
+    """
+    Find where to split text so that the first part fits in window characters.
+
+    Paragraph breaks and code-block boundaries are preferred, then line breaks,
+    then spaces. A hard cut is used only when nothing else is available.
+
+    Returns:
+        Tuple[int, int]: End of the first part and start of the remainder
+    """
+    head = text[:window + 1]
+    minimum = window // 4
+    boundary = newline = -1
+    in_fence = False
+    offset = 0
+    for piece in head.split("\n")[:-1]:
+        end = offset + len(piece)
+        if end > window:
+            break
+        if piece.startswith(FENCE):
+            in_fence = not in_fence
+            # Break just before an opening fence or just after a closing one
+            if in_fence and offset > 0:
+                boundary = offset - 1
+            elif not in_fence:
+                boundary = end
+        elif piece == "" and offset > 0 and not in_fence:
+            boundary = offset - 1
+        if end > 0:
+            newline = end
+        offset = end + 1
+
+    if boundary >= minimum:
+        return boundary, boundary + 1
+    if newline >= minimum:
+        return newline, newline + 1
+    space = text.rfind(" ", minimum, window + 1)
+    if space > 0:
+        return space, space + 1
+    return window, window
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """
+    Split text into chunks that Telegram will accept.
+
+    Code blocks that have to be split are closed at the end of one chunk and
+    reopened at the start of the next, so every chunk renders on its own.
+
+    Args:
+        text (str): The text to split
+        limit (int): Maximum length of a chunk
+
+    Returns:
+        List[str]: Non-empty chunks, in order
+    """
+    chunks = []
+    # Leave room for the closing fence appended to a split code block
+    window = limit - len(FENCE) - 1
+    while len(text) > limit:
+        end, resume = _find_cut(text, window)
+        head, rest = text[:end].rstrip("\n"), text[resume:].lstrip("\n")
+        opening = _open_fence(head)
+        if opening is not None:
+            reopened = _fence_marker(opening) + "\n" + rest
+            # Only reopen when the remainder still gets shorter; otherwise the
+            # loop would never end, so leave the block open instead
+            if len(reopened) < len(text):
+                head += "\n" + FENCE
+                rest = reopened
+        text = rest
+        if head.strip():
+            chunks.append(head)
+    if text.strip():
+        chunks.append(text)
+    return chunks
+
+
+def _retry_seconds(retry_after: Union[int, float, timedelta]) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class _Outgoing:
+    """
+    A text waiting in a chat's queue together with its delivery future.
+    """
+
+    __slots__ = ("text", "reply_to", "kwargs", "future")
+
+    def __init__(self, text: str, reply_to: Optional[int], kwargs: Dict[str, Any], future: asyncio.Future):
+        self.text = text
+        self.reply_to = reply_to
+        self.kwargs = kwargs
+        self.future = future
+
+
+def _consume_result(future: asyncio.Future) -> None:
+    # Fire-and-forget sends are already logged by the worker
+    if not future.cancelled():
+        future.exception()
+
+
+class SendQueue:
+    """
+    Per-chat outbound queues drained under per-chat and global token buckets.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = GLOBAL_RATE,
+        private_chat_rate: float = PRIVATE_CHAT_RATE,
+        group_chat_rate: float = GROUP_CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+    ):
+        """
+        Initialize the send queue.
+
+        Args:
+            bot (Bot): The bot used to deliver messages
+            global_rate (float): Messages per second allowed across all chats
+            private_chat_rate (float): Messages per second allowed in a private chat
+            group_chat_rate (float): Messages per second allowed in a group chat
+            chat_burst (float): Messages a single chat may send back to back
+        """
+        self.bot = bot
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._pending: Dict[int, Deque[_Outgoing]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Group and channel ids are negative
+            rate = self.group_chat_rate if chat_id < 0 else self.private_chat_rate
+            bucket = TokenBucket(rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def send_text(
+        self,
+        chat_id: int,
+        text: str,
+        wait: bool = True,
+        reply_to: Optional[int] = None,
+        **kwargs
+    ) -> List[Message]:
+        """
+        Queue a text message for delivery to a chat.
+
+        Args:
+            chat_id (int): The chat to send to
+            text (str): The message text, of any length
+            wait (bool): Wait until the message has been delivered
+            reply_to (Optional[int]): Message the first chunk should reply to
+            **kwargs: Extra arguments passed to Bot.send_message
+
+        Returns:
+            List[Message]: The sent messages, or an empty list when not waiting
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(chat_id, deque()).append(_Outgoing(text, reply_to, kwargs, future))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+
+        if not wait:
+            future.add_done_callback(_consume_result)
+            return []
+        return await future
+
+    def _take_batch(self, queue: Deque[_Outgoing]) -> List[_Outgoing]:
+        """
+        Pop the next item plus any following items that can share its message.
+        """
+        batch = [queue.popleft()]
+        length = len(batch[0].text)
+        while queue and queue[0].kwargs == batch[0].kwargs and queue[0].reply_to == batch[0].reply_to:
+            length += 2 + len(queue[0].text)
+            if length > MAX_MESSAGE_LENGTH:
+                break
+            batch.append(queue.popleft())
+        return batch
+
+    async def _drain(self, chat_id: int) -> None:
+        queue = self._pending[chat_id]
+        try:
+            while queue:
+                batch = self._take_batch(queue)
+                text = "\n\n".join(item.text for item in batch)
+                try:
+                    messages = await self._deliver(chat_id, text, batch[0].reply_to, batch[0].kwargs)
+                except Exception as e:
+                    logger.error(f"Error sending message to chat {chat_id}: {str(e)}")
+                    for item in batch:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+                else:
+                    for item in batch:
+                        if not item.future.done():
+                            item.future.set_result(messages)
+        finally:
+            for item in queue:
+                item.future.cancel()
+            del self._pending[chat_id]
+            del self._workers[chat_id]
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is not None:
+                asyncio.get_running_loop().call_later(
+                    bucket.seconds_until_full(), self._prune_bucket, chat_id
+                )
+
+    def _prune_bucket(self, chat_id: int) -> None:
+        """
+        Forget an idle chat's bucket once it has refilled.
+        """
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None or chat_id in self._workers:
+            return
+        remaining = bucket.seconds_until_full()
+        if remaining > 0:
+            asyncio.get_running_loop().call_later(remaining, self._prune_bucket, chat_id)
+            return
+        del self._chat_buckets[chat_id]
+
+    async def _deliver(
+        self,
+        chat_id: int,
+        text: str,
+        reply_to: Optional[int],
+        kwargs: Dict[str, Any]
+    ) -> List[Message]:
+        messages = []
+        for index, chunk in enumerate(split_message(text)):
+            chunk_kwargs = kwargs
+            if index == 0 and reply_to is not None:
+                chunk_kwargs = dict(kwargs, reply_parameters=ReplyParameters(
+                    message_id=reply_to, allow_sending_without_reply=True
+                ))
+            messages.append(await self._send_chunk(chat_id, chunk, chunk_kwargs))
+        return messages
+
+    async def _send_chunk(self, chat_id: int, chunk: str, kwargs: Dict[str, Any]) -> Message:
+        bucket = self._chat_bucket(chat_id)
+        for attempt in range(MAX_RETRIES):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await self.bot.send_message(chat_id=chat_id, text=chunk, **kwargs)
+            except RetryAfter as e:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                delay = _retry_seconds(e.retry_after)
+                logger.warning(f"Flood limit hit for chat {chat_id}, retrying in {delay}s")
+                bucket.pause(delay)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """
+        Wait for queued messages to be delivered, then cancel what is left.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait
+        """
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+
+# Shared send queue (will be set in setup_send_queue)
+send_queue: Optional[SendQueue] = None
+
+
+def setup_send_queue(bot: Bot) -> SendQueue:
+    """
+    Set up the shared send queue used by all handlers.
+
+    Args:
+        bot (Bot): The bot used to deliver messages
+
+    Returns:
+        SendQueue: The shared send queue
+    """
+    global send_queue
+    send_queue = SendQueue(bot)
+    logger.info("Outbound send queue set up")
+    return send_queue
+
+
+async def reply_text(update: Update, text: str, wait: bool = True, **kwargs) -> List[Message]:
+    """
+    Reply in the chat of the given update through the shared send queue.
+
+    Like Message.reply_text, the reply quotes the triggering message in group
+    chats but not in private chats.
+
+    Args:
+        update (Update): The update being answered
+        text (str): The reply text, of any length
+        wait (bool): Wait until the reply has been delivered
+        **kwargs: Extra arguments passed to Bot.send_message
+
+    Returns:
+        List[Message]: The sent messages, or an empty list when not waiting
+    """
+    if send_queue is None:
+        return [await update.message.reply_text(text, **kwargs)]
+    chat = update.effective_chat
+    reply_to = None
+    if chat.type != ChatType.PRIVATE and update.effective_message is not None:
+        reply_to = update.effective_message.message_id
+    return await send_queue.send_text(chat.id, text, wait=wait, reply_to=reply_to, **kwargs)
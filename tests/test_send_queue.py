@@ -0,0 +1,127 @@
+import asyncio
+import json
+import random
+import time
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.error import RetryAfter
+
+from send_queue import FENCE, SendQueue, split_message
+
+
+def _words(text):
+    return "".join(text.split())
+
+
+def test_short_text_is_not_split():
+    assert split_message("hello\n\nworld") == ["hello\n\nworld"]
+
+
+def test_splits_at_paragraph_boundaries():
+    paragraphs = [chr(ord("a") + i) * 999 for i in range(10)]
+    chunks = split_message("\n\n".join(paragraphs))
+
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    # Every chunk is made of whole paragraphs
+    for chunk in chunks:
+        assert all(part in paragraphs for part in chunk.split("\n\n"))
+    assert "\n\n".join(chunks) == "\n\n".join(paragraphs)
+
+
+def test_split_code_block_is_closed_and_reopened():
+    code = "\n".join(f"x = {i}  # line" for i in range(1000))
+    chunks = split_message(f"Here you go:\n\n```python\n{code}\n```")
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 4096
+        assert chunk.count(FENCE) % 2 == 0
+        # Lines are never cut in half
+        for line in chunk.split("\n"):
+            assert line.startswith(FENCE) or line.endswith("# line") or line in ("", "Here you go:")
+    for chunk in chunks[1:]:
+        assert chunk.startswith("```python\n")
+
+
+def test_no_content_is_lost():
+    rng = random.Random(0)
+    for _ in range(50):
+        parts = []
+        for _ in range(rng.randint(1, 40)):
+            words = " ".join(f"w{rng.randint(0, 999)}" for _ in range(rng.randint(1, 80)))
+            parts.append(f"```\n{words}\n```" if rng.random() < 0.2 else words)
+        text = rng.choice(["\n", "\n\n"]).join(parts)
+        chunks = split_message(text, 300)
+
+        assert all(len(chunk) <= 300 for chunk in chunks)
+        joined = "".join(_words(chunk) for chunk in chunks)
+        # Only the fences added around split code blocks may be extra
+        assert joined.replace(FENCE, "") == _words(text).replace(FENCE, "")
+
+
+def test_long_fence_line_does_not_hang():
+    text = FENCE + "a" * 1500 + "\n" + "b" * 5000
+    chunks = split_message(text)
+
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    assert "".join(_words(chunk) for chunk in chunks).replace(FENCE, "") == _words(text).replace(FENCE, "")
+
+
+def test_single_line_fenced_json_does_not_hang():
+    payload = json.dumps({f"key{i}": list(range(20)) for i in range(100)}, separators=(",", ":"))
+    text = FENCE + "json " + payload
+    chunks = split_message(text)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    # Reopened with the language tag only, not the whole opening line
+    for chunk in chunks[1:]:
+        assert chunk.startswith(FENCE + "json\n")
+    assert "".join(_words(chunk) for chunk in chunks).replace(FENCE + "json", "").replace(FENCE, "") == \
+        _words(payload)
+
+
+class FakeBot:
+    def __init__(self, flood_waits=()):
+        self.flood_waits = list(flood_waits)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.flood_waits:
+            raise RetryAfter(self.flood_waits.pop(0))
+        self.sent.append((time.monotonic(), chat_id, text))
+        return len(self.sent)
+
+
+def test_retry_after_waits_only_the_requested_time():
+    async def run():
+        bot = FakeBot(flood_waits=[1])
+        queue = SendQueue(bot)
+        start = time.monotonic()
+        await queue.send_text(1, "hello")
+        return bot.sent[0][0] - start
+
+    elapsed = asyncio.run(run())
+    assert 1.0 <= elapsed < 1.5
+
+
+def test_queued_texts_for_a_chat_are_merged():
+    async def run():
+        bot = FakeBot()
+        queue = SendQueue(bot)
+        results = await asyncio.gather(
+            queue.send_text(1, "one"),
+            queue.send_text(1, "two", reply_to=7),
+            queue.send_text(1, "three", reply_to=7),
+            queue.send_text(2, "other chat"),
+        )
+        return bot, results
+
+    bot, results = asyncio.run(run())
+    # Different reply targets are never merged
+    assert [text for _, chat_id, text in bot.sent if chat_id == 1] == ["one", "two\n\nthree"]
+    assert [text for _, chat_id, text in bot.sent if chat_id == 2] == ["other chat"]
+    assert results[1] == results[2]
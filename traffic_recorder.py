@@ -0,0 +1,201 @@
+"""
+Opt-in recording of LLM traffic for offline benchmarking.
+
+When OLLAMA_RECORD_PATH is set, every chat request made by OllamaConnector is
+appended as one compact JSON line to a rotating log. Writing happens on a
+background thread so neither the event loop nor the Ollama thread pool waits
+on disk I/O. The log can be replayed against any Ollama endpoint with
+replay.py.
+"""
+
+import atexit
+import glob
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+RECORD_PATH = os.environ.get('OLLAMA_RECORD_PATH')
+RECORD_MAX_BYTES = int(os.environ.get('OLLAMA_RECORD_MAX_BYTES', 50 * 1024 * 1024))
+RECORD_BACKUPS = int(os.environ.get('OLLAMA_RECORD_BACKUPS', 5))
+RECORD_REDACT = os.environ.get('OLLAMA_RECORD_REDACT', 'false').lower() == 'true'
+
+# Timing and token fields reported by Ollama with every completed response
+RESPONSE_STATS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+
+
+def redact_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Replace message contents with their length and a hash.
+
+    The length lets replay.py send a prompt of similar size without the
+    original text ever being written to disk.
+
+    Args:
+        messages (List[Dict[str, Any]]): Chat messages in Ollama format
+
+    Returns:
+        List[Dict[str, Any]]: Messages without their content
+    """
+    redacted = []
+    for message in messages:
+        content = message.get("content") or ""
+        redacted.append({
+            "role": message.get("role"),
+            "length": len(content),
+            "sha256": hashlib.sha256(content.encode("utf-8")).hexdigest()[:16],
+        })
+    return redacted
+
+
+class TrafficRecorder:
+    """
+    Appends LLM requests to a rotating JSONL log from a background thread.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = RECORD_MAX_BYTES,
+        backups: int = RECORD_BACKUPS,
+        redact: bool = RECORD_REDACT,
+    ):
+        """
+        Initialize the recorder and start its writer thread.
+
+        Args:
+            path (str): Path of the active log file
+            max_bytes (int): Size at which the log is rotated
+            backups (int): Number of rotated files to keep
+            redact (bool): Store message lengths and hashes instead of contents
+        """
+        self.path = path
+        self.redact = redact
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+        )
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+
+        # A dedicated logger keeps traffic out of the application log
+        self._queue: queue.Queue = queue.Queue()
+        self._logger = logging.getLogger(f"{__name__}.traffic")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(logging.handlers.QueueHandler(self._queue))
+        self._listener = logging.handlers.QueueListener(self._queue, file_handler)
+        self._listener.start()
+        self._running = True
+        atexit.register(self.close)
+
+        logger.info(f"Recording LLM traffic to {path} (redact={redact})")
+
+    def record(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        options: Optional[Dict[str, Any]],
+        started: float,
+        latency: float,
+        response: Any = None,
+        error: Optional[str] = None,
+        route: Optional[str] = None,
+    ) -> None:
+        """
+        Queue one request for writing. Never blocks on disk I/O.
+
+        Args:
+            model (str): Model the request was sent to
+            messages (List[Dict[str, Any]]): Chat messages sent to the model
+            options (Optional[Dict[str, Any]]): Generation options sent to the model
+            started (float): Wall-clock time the request was sent
+            latency (float): Seconds until the full response was received
+            response (Any): The Ollama response, if any
+            error (Optional[str]): Error message if the request failed
+            route (Optional[str]): Routing tier that sent the request, if routing is enabled
+        """
+        entry = {
+            "ts": round(started, 3),
+            "model": model,
+            "messages": redact_messages(messages) if self.redact else messages,
+            "options": options or {},
+            "latency": round(latency, 4),
+        }
+        if response is not None:
+            for field in RESPONSE_STATS:
+                value = response.get(field)
+                if value is not None:
+                    entry[field] = value
+        if error is not None:
+            entry["error"] = error
+        if route is not None:
+            entry["route"] = route
+
+        try:
+            self._logger.info(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+        except Exception as e:
+            logger.warning(f"Could not record LLM request: {str(e)}")
+
+    def close(self) -> None:
+        """
+        Flush pending entries and stop the writer thread.
+        """
+        if self._running:
+            self._running = False
+            self._listener.stop()
+
+
+def read_traffic(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read recorded entries from a log and its rotated backups, oldest first.
+
+    Args:
+        path (str): Path of the active log file
+
+    Yields:
+        Dict[str, Any]: Recorded entries in chronological order
+    """
+    # RotatingFileHandler names backups path.1 (newest) to path.N (oldest)
+    rotated = [name for name in glob.glob(f"{glob.escape(path)}.*") if name.rsplit(".", 1)[1].isdigit()]
+    rotated.sort(key=lambda name: int(name.rsplit(".", 1)[1]), reverse=True)
+    for name in rotated + [path]:
+        if not os.path.exists(name):
+            continue
+        with open(name, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+# Shared recorder (created on first use when recording is enabled)
+_recorder: Optional[TrafficRecorder] = None
+
+
+def get_traffic_recorder() -> Optional[TrafficRecorder]:
+    """
+    Return the shared recorder, or None when OLLAMA_RECORD_PATH is not set.
+
+    Returns:
+        Optional[TrafficRecorder]: The shared recorder
+    """
+    global _recorder
+    if _recorder is None and RECORD_PATH:
+        _recorder = TrafficRecorder(RECORD_PATH)
+    return _recorder